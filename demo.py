@@ -1,20 +1,29 @@
-import time
+import json
 import numpy as np
+import orjson
 import pandas as pd
 import pydeck as pdk
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit_autorefresh import st_autorefresh
 
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
 from typing import List, Dict, Any
 
 from utils import (
     fetch_live_flights,
+    FLIGHTS_TTL_S,
     fetch_sigmet_geojson,
-    routes_to_linestrings,
-    route_buffers,
+    routes_key,
+    build_route_corridor,
     hazards_intersecting_route,
     flights_to_layer,
     sigmet_geojson_layer,
-    sigmet_pulse_layers,
+    sigmet_pulse_frame,
+    sigmet_pulse_layer,
+    PULSE_LAYER_ID,
 )
 
 # --------------------
@@ -22,19 +31,23 @@ from utils import (
 # --------------------
 N_POINTS = 100
 CYCLE_DURATION_MS = 3000
-FRAME_RATE = 30
-SLEEP_TIME = 1 / FRAME_RATE
 PLANE_SPEED_FACTOR = 2
 
 ROUTE_COLOR = [0, 150, 255]
 PLANE_COLOR = [255, 255, 255]
 PLANE_RADIUS = 25000
 ARC_WIDTH = 3
+PLANE_LAYER_ID = "planes"
 
 VIEW_LAT = 22
 VIEW_LON = 78
 VIEW_ZOOM = 5
 VIEW_PITCH = 30
+MAP_HEIGHT = 700
+# Render at CSS resolution; device pixels quadruple fill-rate on HiDPI screens
+USE_DEVICE_PIXELS = False
+# Just past the flights cache TTL, so each refresh finds the entry expired
+DATA_REFRESH_MS = (FLIGHTS_TTL_S + 5) * 1000
 
 ROUTES = [
     {"from": [77.1, 28.6], "to": [72.87, 19.07]},  # Delhi → Mumbai
@@ -45,18 +58,19 @@ ROUTES = [
 # --------------------
 # HELPERS
 # --------------------
-def precompute_route_points(routes: List[Dict]) -> List[pd.DataFrame]:
+def precompute_route_points(routes: List[Dict]) -> List[np.ndarray]:
     route_points = []
     for route in routes:
-        lons = np.linspace(route["from"][0], route["to"][0], N_POINTS)
-        lats = np.linspace(route["from"][1], route["to"][1], N_POINTS)
-        route_points.append(pd.DataFrame({"lon": lons, "lat": lats}))
+        # float32 is ample for map coordinates and halves the bytes shipped
+        lons = np.linspace(route["from"][0], route["to"][0], N_POINTS, dtype=np.float32)
+        lats = np.linspace(route["from"][1], route["to"][1], N_POINTS, dtype=np.float32)
+        route_points.append(np.column_stack([lons, lats]))
     return route_points
 # Precomputing reduces per-frame overhead for animation [web:11].
 
 def get_route_layers(routes: List[Dict]) -> List[pdk.Layer]:
     layers = []
-    for route in routes:
+    for i, route in enumerate(routes):
         df = pd.DataFrame([{
             "from_lon": route["from"][0], "from_lat": route["from"][1],
             "to_lon": route["to"][0], "to_lat": route["to"][1]
@@ -65,40 +79,162 @@ def get_route_layers(routes: List[Dict]) -> List[pdk.Layer]:
             pdk.Layer(
                 "ArcLayer",
                 data=df,
+                id=f"route-{i}",
                 get_source_position='[from_lon, from_lat]',
                 get_target_position='[to_lon, to_lat]',
                 get_source_color=ROUTE_COLOR,
                 get_target_color=ROUTE_COLOR,
-                get_width=ARC_WIDTH
+                get_width=ARC_WIDTH,
+                pickable=False
             )
         )
     return layers
 # ArcLayer draws clean curves between origin and destination points [web:11].
 
-def get_plane_layers(route_points: List[pd.DataFrame]) -> List[pdk.Layer]:
-    layers = []
-    now = time.time()
-    for points in route_points:
-        frame = int(now * PLANE_SPEED_FACTOR % N_POINTS)
-        plane_pos = points.iloc[frame:frame+1]
-        layers.append(
-            pdk.Layer(
-                "ScatterplotLayer",
-                data=plane_pos,
-                get_position='[lon, lat]',
-                get_fill_color=PLANE_COLOR,
-                get_radius=PLANE_RADIUS
-            )
-        )
-    return layers
+def get_plane_layer(route_points: List[np.ndarray], frame: int) -> pdk.Layer:
+    # One row per route, so all planes share a single layer and draw call
+    planes = [{"lon": float(lon), "lat": float(lat)}
+              for lon, lat in (points[frame] for points in route_points)]
+    return pdk.Layer(
+        "ScatterplotLayer",
+        data=planes,
+        id=PLANE_LAYER_ID,
+        get_position='[lon, lat]',
+        get_fill_color=PLANE_COLOR,
+        get_radius=PLANE_RADIUS,
+        pickable=False
+    )
 # White markers simulate planes moving along routes frame-by-frame [web:11].
 
+# Routes are constants, so their traces and arc layers are built once at load
+# and each render only slices the initial frame.
+ROUTE_POINTS = precompute_route_points(ROUTES)
+ROUTE_LAYERS = get_route_layers(ROUTES)
+ROUTES_KEY = routes_key(ROUTES)
+VIEW_STATE = pdk.ViewState(
+    latitude=VIEW_LAT,
+    longitude=VIEW_LON,
+    zoom=VIEW_ZOOM,
+    pitch=VIEW_PITCH
+)
+
+# Browser-side animation: Python renders the deck once per rerun and this
+# requestAnimationFrame loop advances pulses and planes on the client via
+# deck.setProps, so the server does no per-frame work. `deckInstance` is the
+# global created by pydeck's standalone HTML template.
+ANIMATION_JS = Template("""
+<script>
+(function () {
+  if (typeof deckInstance === "undefined") return;
+  const CYCLE_MS = $cycle_ms;
+  const PLANE_SPEED = $plane_speed;
+  const PULSE_ID = "$pulse_id";
+  const PLANE_ID = "$plane_id";
+  // pydeck has no pass-through for this Deck prop, so set it here
+  deckInstance.setProps({useDevicePixels: $use_device_pixels});
+
+  // New data reloads this iframe; keep the user's pan/zoom across reloads by
+  // saving the view on every change and restoring it over the initial view.
+  const VIEW_KEY = "radar-view";
+  const VIEW_FIELDS = ["longitude", "latitude", "zoom", "pitch", "bearing"];
+  try {
+    const saved = JSON.parse(sessionStorage.getItem(VIEW_KEY));
+    if (saved) {
+      deckInstance.setProps({
+        initialViewState: {...deckInstance.props.initialViewState, ...saved}
+      });
+    }
+  } catch (e) {}  // storage unavailable or corrupt: keep the default view
+  deckInstance.setProps({
+    onViewStateChange: ({viewState}) => {
+      const view = {};
+      VIEW_FIELDS.forEach(k => { if (k in viewState) view[k] = viewState[k]; });
+      try { sessionStorage.setItem(VIEW_KEY, JSON.stringify(view)); } catch (e) {}
+      return viewState;
+    }
+  });
+  const TRACES = $traces;
+  // Plane rows are mutated in place; updateTriggers tells deck.gl to re-read them
+  const planes = TRACES.map(trace => ({lon: trace[0][0], lat: trace[0][1]}));
+  let rafId = null;
+  let onScreen = true;
+
+  function tick() {
+    const now = Date.now();
+    const scale = (now % CYCLE_MS) / CYCLE_MS;
+    const frame = Math.floor(now / 1000 * PLANE_SPEED) % TRACES[0].length;
+
+    const layers = deckInstance.props.layers.map(layer => {
+      if (layer.id === PULSE_ID) {
+        // Only uniforms change; radius/color attribute buffers are reused
+        return layer.clone({radiusScale: 0.2 + 0.8 * scale, opacity: 1 - scale});
+      }
+      if (layer.id === PLANE_ID) {
+        TRACES.forEach((trace, i) => {
+          planes[i].lon = trace[frame][0];
+          planes[i].lat = trace[frame][1];
+        });
+        return layer.clone({data: planes, updateTriggers: {getPosition: frame}});
+      }
+      return layer;
+    });
+    deckInstance.setProps({layers});
+    rafId = requestAnimationFrame(tick);
+  }
+
+  // Run only while the tab is visible and the map is scrolled into view.
+  // Hidden tabs already pause rAF, but this same-origin iframe keeps ticking
+  // when merely scrolled off-screen.
+  function sync() {
+    const run = onScreen && !document.hidden;
+    if (run && rafId === null) {
+      rafId = requestAnimationFrame(tick);
+    } else if (!run && rafId !== null) {
+      cancelAnimationFrame(rafId);
+      rafId = null;
+    }
+  }
+  document.addEventListener("visibilitychange", sync);
+  if ("IntersectionObserver" in window) {
+    new IntersectionObserver(entries => {
+      onScreen = entries[entries.length - 1].isIntersecting;
+      sync();
+    }).observe(document.getElementById("deck-container") || document.body);
+  }
+  sync();
+})();
+</script>
+""")
+ANIMATION_SCRIPT = ANIMATION_JS.substitute(
+    cycle_ms=CYCLE_DURATION_MS,
+    plane_speed=PLANE_SPEED_FACTOR,
+    pulse_id=PULSE_LAYER_ID,
+    plane_id=PLANE_LAYER_ID,
+    use_device_pixels=json.dumps(USE_DEVICE_PIXELS),
+    # orjson writes float32 at float32 precision; tolist() would widen to float64 digits
+    traces=orjson.dumps(np.stack(ROUTE_POINTS), option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+)
+
+def render_animated_deck(deck: pdk.Deck) -> str:
+    html = deck.to_html(as_string=True, notebook_display=False)
+    # pydeck's template declares deckInstance in a <script> after </body>, so
+    # the animation must come after it, right before </html>
+    head, sep, tail = html.rpartition("</html>")
+    if not sep:
+        return html + ANIMATION_SCRIPT
+    return head + ANIMATION_SCRIPT + sep + tail
+# The deck is serialized once per rerun; the embedded script drives every later frame.
+
 # --------------------
 # STREAMLIT APP
 # --------------------
 st.set_page_config(page_title="Flight Radar + SIGMETs", layout="wide")
 st.title("✈️ Flight Radar with Live SIGMET Hazards")
 
+# Reruns are timer-driven from the browser: each run renders once and returns,
+# so no script run is held open and live data refreshes just after the cache TTL.
+st_autorefresh(interval=DATA_REFRESH_MS, key="radar")
+
 # Sidebar controls
 col1, col2 = st.columns(2)
 with col1:
@@ -107,62 +243,59 @@ with col2:
     buffer_km = st.slider("Route buffer (km)", 20, 150, 60, 10)
 
 # Initial data fetch (cached with TTL inside utils)
+# Both fetches are I/O-bound, so run them side by side; worker threads get the
+# script context so Streamlit caching behaves as on the main thread.
 with st.spinner("Fetching hazards and flights..."):
-    sigmet_geo = fetch_sigmet_geojson()
-    live_flights = fetch_live_flights({"limit": flights_limit})
+    with ThreadPoolExecutor(
+        max_workers=2,
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    ) as pool:
+        sigmet_future = pool.submit(fetch_sigmet_geojson)
+        flights_future = pool.submit(fetch_live_flights, {"limit": flights_limit})
+        sigmet_geo = sigmet_future.result()
+        live_flights = flights_future.result()
 # AWC Data API provides SIGMET GeoJSON, and AviationStack provides live flights [web:60][web:90].
 
 # Geometry for relevance filter
-route_lines = routes_to_linestrings(ROUTES)
-buffers = route_buffers(route_lines, km=buffer_km)
-sigmet_hits = hazards_intersecting_route(sigmet_geo, buffers)
+corridor = build_route_corridor(ROUTES_KEY, buffer_km)
+sigmet_hits, sigmet_centroids = hazards_intersecting_route(sigmet_geo, corridor)
 hit_collection = {"type": "FeatureCollection", "features": sigmet_hits}
 # Intersecting filters ensure only relevant hazards near the route corridor render [web:60].
 
 # Build layers
-route_layers = get_route_layers(ROUTES)
-plane_traces = precompute_route_points(ROUTES)
-plane_layers = get_plane_layers(plane_traces)
 hazard_layer = sigmet_geojson_layer(hit_collection)
 flights_layer = flights_to_layer(live_flights)
+pulse_df = sigmet_pulse_frame(sigmet_hits, sigmet_centroids)
 # GeoJsonLayer renders polygons, ScatterplotLayer renders points for flights/planes [web:11].
 
-# Animation placeholder
-chart_placeholder = st.empty()
-
-# NOTE: Keep API calls out of the animation loop; only animate local layers
-# Streamlit reruns the script on each interaction; an infinite loop is acceptable here
-# for a demo, but consider using st.autorefresh pattern for production [web:92].
-
+# NOTE: Keep API calls out of the animation; only local layers are animated.
+# The script renders the initial frame and returns; the browser animates from there.
+# The HTML must be identical across reruns with unchanged data (fixed initial
+# phase, stable layer ids) so Streamlit keeps the existing iframe. When flights
+# or SIGMETs do change, the iframe reloads and the animation script restores
+# the user's last view from sessionStorage.
 try:
-    while True:
-        t = (time.time() * 1000) % CYCLE_DURATION_MS
-        scale = t / CYCLE_DURATION_MS
-
-        pulse_layers = sigmet_pulse_layers(sigmet_hits, scale)
+    pulse_layer = sigmet_pulse_layer(pulse_df, 0.0)
+    plane_layer = get_plane_layer(ROUTE_POINTS, 0)
 
-        view_state = pdk.ViewState(
-            latitude=VIEW_LAT,
-            longitude=VIEW_LON,
-            zoom=VIEW_ZOOM,
-            pitch=VIEW_PITCH
-        )
+    layers = []
+    layers += ROUTE_LAYERS
+    layers.append(plane_layer)
+    if flights_layer:
+        layers.append(flights_layer)
+    if hazard_layer:
+        layers.append(hazard_layer)
+    if pulse_layer:
+        layers.append(pulse_layer)
 
-        layers = []
-        layers += route_layers
-        layers += plane_layers
-        if flights_layer:
-            layers.append(flights_layer)
-        if hazard_layer:
-            layers.append(hazard_layer)
-        layers += pulse_layers
-
-        deck = pdk.Deck(
-            layers=layers,
-            initial_view_state=view_state,
-            map_style=None  # choose default or a style of choice
-        )
-        chart_placeholder.pydeck_chart(deck)
-        time.sleep(1 / FRAME_RATE)
+    deck = pdk.Deck(
+        layers=layers,
+        initial_view_state=VIEW_STATE,
+        map_style=None  # choose default or a style of choice
+    )
+    # components.html embeds the standalone deck.gl page directly, which is
+    # much cheaper than st.pydeck_chart.
+    components.html(render_animated_deck(deck), height=MAP_HEIGHT)
 except Exception as e:
     st.error(f"Animation error: {e}")
@@ -1,10 +1,17 @@
 import time
-import requests
+import base64
+import hashlib
+import httpx
+import orjson
+import numpy as np
 import pandas as pd
 import pydeck as pdk
-from typing import List, Dict, Any, Optional
+from pydeck.bindings import json_tools
+from typing import List, Dict, Any, Optional, Tuple, Union
 
-from shapely.geometry import LineString, shape, Point, Polygon, MultiPolygon
+import shapely
+from shapely import STRtree
+from shapely.geometry import LineString, Point, Polygon, MultiPolygon
 from shapely.ops import unary_union
 
 import streamlit as st
@@ -13,7 +20,15 @@ import streamlit as st
 # API FETCHERS
 # --------------------
 
-@st.cache_data(ttl=90)
+# One pooled HTTP/2 client per process: cache misses reuse the open
+# connection instead of paying a fresh TCP+TLS handshake (needs httpx[http2]).
+# httpx already negotiates gzip/deflate (plus br/zstd when installed); unlike
+# requests it does not follow redirects unless asked.
+_CLIENT = httpx.Client(http2=True, timeout=20.0, follow_redirects=True)
+
+FLIGHTS_TTL_S = 90
+
+@st.cache_data(ttl=FLIGHTS_TTL_S)
 def fetch_live_flights(params: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     Fetch live flights from AviationStack.
@@ -22,9 +37,9 @@ def fetch_live_flights(params: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
     url = "https://api.aviationstack.com/v1/flights"
     q = {"access_key": st.secrets["aviationstack_key"], **params}
-    r = requests.get(url, params=q, timeout=20)
+    r = _CLIENT.get(url, params=q)
     r.raise_for_status()
-    data = r.json()
+    data = orjson.loads(r.content)
     # Aviationstack returns in 'data'
     return data.get("data", [])  # list of flights
     # See docs for fields like 'live.latitude/longitude' and schedule info [web:90].
@@ -36,9 +51,9 @@ def fetch_sigmet_geojson() -> Dict[str, Any]:
     Free, no key required.
     """
     url = "https://aviationweather.gov/api/data/sigmet?format=geojson"
-    r = requests.get(url, timeout=20)
+    r = _CLIENT.get(url)
     r.raise_for_status()
-    return r.json()
+    return orjson.loads(r.content)
     # AWC provides aviation hazards like turbulence/icing/convective polygons [web:60].
 
 # --------------------
@@ -59,62 +74,115 @@ def route_buffers(lines: List[LineString], km: float = 60.0) -> List[Polygon]:
     return [ln.buffer(deg) for ln in lines]
     # Buffer creates a corridor around routes to detect nearby hazards [web:11].
 
+RouteKey = Tuple[Tuple[Tuple[float, float], Tuple[float, float]], ...]
+
+def routes_key(routes: List[Dict[str, Any]]) -> RouteKey:
+    # Hashable form of routes for use as a cache key
+    return tuple((tuple(r["from"]), tuple(r["to"])) for r in routes)
+
+@st.cache_resource
+def build_route_corridor(routes: RouteKey, km: float) -> Union[Polygon, MultiPolygon]:
+    """
+    Prepared union of the route buffers (a MultiPolygon when routes are disjoint).
+    Cached per (routes, km) so reruns skip the GEOS work.
+    """
+    lines = routes_to_linestrings([{"from": a, "to": b} for a, b in routes])
+    union_buf = unary_union(route_buffers(lines, km=km))
+    shapely.prepare(union_buf)
+    return union_buf
+
+@st.cache_resource(max_entries=4)
+def sigmet_index(sigmet_key: str,
+                 _features: List[Dict[str, Any]]) -> Tuple[STRtree, np.ndarray, np.ndarray]:
+    """
+    Parse SIGMET geometries once per feed and index them in an STRtree.
+    sigmet_key identifies the feed content; returns the tree and, per tree
+    entry, the index of its source feature and its (lon, lat) centroid.
+    """
+    feat_idx = np.array([i for i, f in enumerate(_features) if f.get("geometry")], dtype=np.intp)
+    raw = np.array([orjson.dumps(_features[i]["geometry"]).decode() for i in feat_idx], dtype=object)
+    # Bulk parse in GEOS; unparseable geometries come back as None
+    geoms = shapely.from_geojson(raw, on_invalid="ignore")
+    ok = shapely.is_valid(geoms) & ~shapely.is_empty(geoms)
+    geoms = geoms[ok]
+    # Centroids help place pulses/markers inside hazard polygons [web:11].
+    centroids = shapely.get_coordinates(shapely.centroid(geoms))
+    return STRtree(geoms), feat_idx[ok], centroids
+    # The tree prunes candidates by bounding box before exact intersection tests.
+
 def hazards_intersecting_route(sigmet_geojson: Dict[str, Any],
-                               buffers: List[Polygon]) -> List[Dict[str, Any]]:
+                               corridor: Union[Polygon, MultiPolygon]) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    SIGMET features intersecting the corridor (the ideally prepared union of
+    route buffers, see build_route_corridor) and their (N, 2) lon/lat centroids.
+    """
     if not sigmet_geojson or "features" not in sigmet_geojson:
-        return []
-    union_buf = unary_union(buffers)
-    hits = []
-    for feat in sigmet_geojson["features"]:
-        geom_json = feat.get("geometry")
-        if not geom_json:
-            continue
-        try:
-            geom = shape(geom_json)
-        except Exception:
-            continue
-        if geom.is_valid and geom.intersects(union_buf):
-            hits.append(feat)
-    return hits
+        return [], np.empty((0, 2))
+    features = sigmet_geojson["features"]
+    sigmet_key = hashlib.sha1(orjson.dumps(features, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    tree, feat_idx, centroids = sigmet_index(sigmet_key, features)
+    shapely.prepare(corridor)  # no-op when already prepared
+    # Bounding-box candidates from the tree, then one vectorized exact test;
+    # the prepared corridor must be the first argument for GEOS to use it
+    cand = np.sort(tree.query(corridor))
+    hit = cand[shapely.intersects(corridor, tree.geometries[cand])]
+    return [features[i] for i in feat_idx[hit]], centroids[hit]
     # Only hazards that affect the route corridor are returned, reducing noise [web:60].
 
-def polygon_centroid(feature: Dict[str, Any]) -> Optional[Dict[str, float]]:
-    try:
-        geom = shape(feature.get("geometry"))
-        c = geom.centroid
-        return {"lon": float(c.x), "lat": float(c.y)}
-    except Exception:
-        return None
-    # Centroids help place pulses/markers inside hazard polygons [web:11].
+# --------------------
+# PYDECK SERIALIZATION
+# --------------------
+
+def orjson_serialize(serializable: Any) -> str:
+    """
+    Drop-in for pydeck's json_tools.serialize backed by orjson; numpy arrays
+    and scalars are encoded natively instead of failing or going through lists.
+    """
+    return orjson.dumps(
+        serializable,
+        default=json_tools.default_serialize,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS,
+    ).decode()
+
+# Deck.to_json/to_html resolve serialize from json_tools at call time
+json_tools.serialize = orjson_serialize
 
 # --------------------
 # PYDECK LAYER BUILDERS
 # --------------------
 
+def flight_position(f: Dict[str, Any]) -> Tuple[float, float]:
+    """
+    (lon, lat) of a flight, preferring live positions and falling back to
+    arrival/airport coords if available; (nan, nan) when neither is known.
+    """
+    live = f.get("live") or {}
+    lon = live.get("longitude")
+    lat = live.get("latitude")
+    # fallback to known coordinates if live absent (varies by plan/endpoint)
+    if lon is None or lat is None:
+        arr = f.get("arrival") or {}
+        lon = arr.get("longitude")
+        lat = arr.get("latitude")
+    if lon is None or lat is None:
+        return np.nan, np.nan
+    return float(lon), float(lat)
+
 def flights_to_layer(flights: List[Dict[str, Any]]) -> Optional[pdk.Layer]:
     """
-    Build a ScatterplotLayer for flight positions.
-    Prefers live positions if present; falls back to arrival/airport coords if available.
-    """
-    pts = []
-    for f in flights:
-        live = f.get("live") or {}
-        lon = live.get("longitude")
-        lat = live.get("latitude")
-        # fallback to known coordinates if live absent (varies by plan/endpoint)
-        if lon is None or lat is None:
-            arr = f.get("arrival") or {}
-            lon = arr.get("longitude")
-            lat = arr.get("latitude")
-        if lon is None or lat is None:
-            continue
-        pts.append({"lon": float(lon), "lat": float(lat)})
-    if not pts:
+    Build a ScatterplotLayer for flight positions (see flight_position).
+    """
+    # One pass into a (N, 2) array, then build the DataFrame from columns
+    pos = np.fromiter((flight_position(f) for f in flights),
+                      dtype=np.dtype((np.float64, 2)), count=len(flights))
+    pos = pos[~np.isnan(pos).any(axis=1)]
+    if not len(pos):
         return None
-    df = pd.DataFrame(pts)
+    df = pd.DataFrame.from_dict({"lon": pos[:, 0], "lat": pos[:, 1]})
     return pdk.Layer(
         "ScatterplotLayer",
         data=df,
+        id="flights",
         get_position='[lon, lat]',
         get_fill_color=[0, 255, 180],
         get_radius=12000,
@@ -122,48 +190,77 @@ def flights_to_layer(flights: List[Dict[str, Any]]) -> Optional[pdk.Layer]:
     )
     # ScatterplotLayer is efficient for many points with per-point styling [web:11].
 
+def geojson_data_url(geojson: Dict[str, Any]) -> str:
+    # Serialize once with orjson; pydeck then embeds one opaque string instead of
+    # re-encoding (and deck.gl's converter re-walking) the nested features.
+    return "data:application/json;base64," + base64.b64encode(orjson.dumps(geojson)).decode("ascii")
+
 def sigmet_geojson_layer(geojson: Dict[str, Any]) -> Optional[pdk.Layer]:
     if not geojson:
         return None
     return pdk.Layer(
         "GeoJsonLayer",
-        geojson,
+        geojson_data_url(geojson),
+        id="sigmet-hazards",
         stroked=True,
         filled=True,
         pickable=True,
         get_fill_color=[255, 0, 0, 40],
         get_line_color=[255, 0, 0, 160],
         line_width_min_pixels=1,
-        auto_highlight=True,
+        # Picking stays on for tooltips; highlight would re-render on every hover
+        auto_highlight=False,
     )
     # GeoJsonLayer renders hazard polygons directly with stroke/fill styling [web:11].
 
-def sigmet_pulse_layers(features: List[Dict[str, Any]], scale: float) -> List[pdk.Layer]:
+PULSE_MAX_RADIUS = 250000.0  # 250 km generic pulse
+# Max pulse radius indexed by SIGMET severity; 0 (missing/unknown) uses the generic pulse
+SEVERITY_MAX_RADIUS = np.array([PULSE_MAX_RADIUS, 150000, 250000, 400000], dtype=np.float32)
+PULSE_COLOR = [255, 60, 0]
+PULSE_ALPHA = 160
+PULSE_LAYER_ID = "sigmet-pulses"  # lets client-side animation find the layer
+
+def feature_severity(feature: Dict[str, Any]) -> int:
+    # SIGMET severity from feature properties; 0 when absent or non-numeric
+    try:
+        return int((feature.get("properties") or {}).get("severity") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def sigmet_pulse_frame(features: List[Dict[str, Any]], centroids: np.ndarray) -> pd.DataFrame:
     """
-    Optional: derive animated pulses at hazard centroids.
+    Static per-hazard pulse data (centroid, max radius, base color).
+    centroids: (N, 2) lon/lat per feature, as from hazards_intersecting_route.
+    Build once per rerun; these columns never change while animating.
+    """
+    df = pd.DataFrame({"lon": centroids[:, 0], "lat": centroids[:, 1]})
+    severities = [feature_severity(feat) for feat in features]
+    sev = np.clip(np.array(severities, dtype=np.intp), 0, len(SEVERITY_MAX_RADIUS) - 1)
+    df["max_radius"] = SEVERITY_MAX_RADIUS[sev]
+    df["r"], df["g"], df["b"] = PULSE_COLOR
+    df["a"] = PULSE_ALPHA
+    return df
+
+def sigmet_pulse_layer(pulse_df: pd.DataFrame, scale: float) -> Optional[pdk.Layer]:
+    """
+    Optional: animated pulses at hazard centroids, batched into one layer.
     scale: 0..1 cycling phase (from app).
     """
-    layers = []
-    for feat in features:
-        c = polygon_centroid(feat)
-        if not c:
-            continue
-        # Simple animated radius + fade
-        max_radius = 250000.0  # 250 km generic pulse
-        radius = max_radius * (0.2 + 0.8 * scale)
-        opacity = int(160 * (1.0 - scale))
-        opacity = max(0, min(255, opacity))
-        df = pd.DataFrame([c])
-        layers.append(
-            pdk.Layer(
-                "ScatterplotLayer",
-                data=df,
-                get_position='[lon, lat]',
-                get_fill_color=[255, 60, 0, opacity],
-                get_radius=radius,
-                stroked=False,
-                filled=True,
-            )
-        )
-    return layers
+    if pulse_df.empty:
+        return None
+    # Simple animated radius + fade via layer-wide radius_scale/opacity, so the
+    # per-pulse radius/color buffers stay fixed and nothing is rebuilt per frame
+    return pdk.Layer(
+        "ScatterplotLayer",
+        data=pulse_df,
+        id=PULSE_LAYER_ID,
+        get_position='[lon, lat]',
+        get_fill_color='[r, g, b, a]',
+        get_radius='max_radius',
+        radius_scale=0.2 + 0.8 * scale,
+        opacity=1.0 - scale,
+        stroked=False,
+        filled=True,
+        pickable=False,
+    )
     # Pulses provide a radar-like cue on top of polygons for attention [web:11].